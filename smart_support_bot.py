@@ -6,19 +6,31 @@
 # Demonstrates:
 # - Two agents (BotAgent, HumanAgent)
 # - @function_tool with is_enabled and error_function
-# - @guardrail to filter negative/offensive input
+# - Guardrail to filter negative/offensive input (run before the model, not alongside it)
 # - Handoff from BotAgent -> HumanAgent
 # - model_settings (tool_choice, metadata)
 # - Logging of tool invocations and handoffs
-
-from dataclasses import dataclass
+# - LRU + TTL caches for repeated FAQ/default answers and per-order agent answers
+# - Batch API path for bulk/offline message processing
+# - Async orchestration with bounded concurrency (asyncio.gather + Semaphore)
+
+import asyncio
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import functools
+import hashlib
+import json
 import logging
 import re
-from typing import Dict, Any
+import sys
+import time
+from types import MappingProxyType
+from typing import Dict, Any, Callable, Hashable, Mapping
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 from openai.agents import Agent, Guardrail, Handoff
-from openai.agents.decorators import function_tool, guardrail
+from openai.agents.decorators import function_tool
 
 # -----------------------------------------------------------------------------
 # Setup
@@ -28,7 +40,15 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
-client = OpenAI()
+# The client is built on first use, so imports and local-only turns (FAQ, ask-for-ID)
+# never pay for client construction.
+@functools.lru_cache(maxsize=1)
+def get_client() -> AsyncOpenAI:
+    return AsyncOpenAI()
+
+# Upper bound on in-flight agent calls (keeps concurrent demos/bulk runs under rate limits)
+MAX_CONCURRENCY = 10
+_LLM_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENCY)
 
 # -----------------------------------------------------------------------------
 # Simulated datastore (Orders + FAQs)
@@ -45,91 +65,172 @@ FAQS = {
     "warranty": "All electronics include a 1-year limited warranty covering manufacturing defects."
 }
 
+# Blocklist data; every guardrail regex below is generated from these lists.
+OFFENSIVE_WORDS = ["dumb", "stupid", "idiot", "hate", "useless"]
+OFFENSIVE_PHRASES = ["shut up"]
+OFFENSIVE_MASKED = [r"f\*?ck", r"s\*?it", r"b\*?tch", r"a\*?shole"]  # regex fragments
+
+NEGATIVE_WORDS = [
+    "angry", "furious", "terrible", "awful", "worst", "hate",
+    "complain", "complaint", "disappointed",
+]
+NEGATIVE_PHRASES = ["refund now", "speak to manager", "not happy"]
+
+def _word_pattern(alternatives: list[str]) -> str:
+    return r"\b(" + "|".join(alternatives) + r")\b"
+
 OFFENSIVE_PATTERNS = [
-    r"\b(dumb|stupid|idiot|shut up|hate|useless)\b",
-    r"\b(f\*?ck|s\*?it|b\*?tch|a\*?shole)\b"
+    _word_pattern([re.escape(t) for t in OFFENSIVE_WORDS + OFFENSIVE_PHRASES]),
+    _word_pattern(OFFENSIVE_MASKED),
 ]
 
 NEGATIVE_SENTIMENT_PATTERNS = [
-    r"\b(angry|furious|terrible|awful|worst|hate|refund now)\b",
-    r"\b(complain|complaint|speak to manager|not happy|disappointed)\b"
+    _word_pattern([re.escape(t) for t in NEGATIVE_WORDS + NEGATIVE_PHRASES]),
 ]
 
+# Compiled once at import: one combined scan per message instead of one per pattern.
+_BAD_RE = re.compile(
+    "|".join(f"(?:{p})" for p in OFFENSIVE_PATTERNS + NEGATIVE_SENTIMENT_PATTERNS),
+    re.IGNORECASE
+)
+
 # -----------------------------------------------------------------------------
 # Helper: intent & sentiment detection (very simple heuristics for demo)
+# is_order_intent expects casefolded text: handle_user_message folds each message once
+# and reuses it. is_negative_or_offensive takes the raw message, so it agrees with the
+# IGNORECASE scan in analyze() (casefolding maps e.g. "ß" to "ss", which IGNORECASE does not).
+# Order-ID extraction and FAQ matching happen in analyze() below.
 # -----------------------------------------------------------------------------
-def is_order_intent(text: str) -> bool:
-    text = text.lower()
-    return "order" in text or "track" in text or "status" in text
+_ORDER_INTENT_TOKENS = ("order", "track", "status")
 
-def extract_order_id(text: str) -> str | None:
-    # Look for tokens like ORD-1234 or ORD1234
-    m = re.search(r"\bORD[- ]?(\d{3,6})\b", text.upper())
-    if m:
-        num = m.group(1)
-        return f"ORD-{num}"
-    return None
+def is_order_intent(text: str) -> bool:
+    return any(tok in text for tok in _ORDER_INTENT_TOKENS)
 
 def is_negative_or_offensive(text: str) -> bool:
-    t = text.lower()
-    for pat in OFFENSIVE_PATTERNS + NEGATIVE_SENTIMENT_PATTERNS:
-        if re.search(pat, t):
-            return True
-    return False
+    return _BAD_RE.search(text) is not None
+
+# -----------------------------------------------------------------------------
+# Fused analysis: every per-message signal from a single regex pass
+# -----------------------------------------------------------------------------
+@dataclass
+class Analysis:
+    negative: bool = False
+    order_intent: bool = False
+    order_id: str | None = None
+    faq_answer: str | None = None
+    complex_hint: bool = False
+
+# One named group per FAQ key: the group name identifies the answer, so case variants that
+# IGNORECASE accepts (e.g. "ſ" for "s") never need mapping back to the dict key.
+_FAQ_GROUPS = {f"faq{i}": answer for i, answer in enumerate(FAQS.values())}
+
+_ANALYZE_RE = re.compile(
+    "|".join([
+        f"(?P<negative>{_BAD_RE.pattern})",
+        r"(?P<order_id>\bORD[- ]?(?P<order_num>\d{3,6})\b)",
+        "(?P<order_intent>" + "|".join(_ORDER_INTENT_TOKENS) + ")",
+        *(f"(?P<faq{i}>{re.escape(key)})" for i, key in enumerate(FAQS)),
+        "(?P<complex_hint>complicated|legal)",
+    ]),
+    re.IGNORECASE
+)
 
-def match_faq(text: str) -> str | None:
-    t = text.lower()
-    for k, v in FAQS.items():
-        if k in t:
-            return v
-    return None
+def analyze(text: str) -> Analysis:
+    # Sentiment, order intent, order ID, FAQ and complexity hints in one scan of the message
+    a = Analysis()
+    for m in _ANALYZE_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "negative":
+            a.negative = True
+        elif kind == "order_id":
+            if a.order_id is None:
+                a.order_id = f"ORD-{m.group('order_num')}"
+        elif kind == "order_intent":
+            a.order_intent = True
+        elif kind == "complex_hint":
+            a.complex_hint = True
+        elif a.faq_answer is None:
+            a.faq_answer = _FAQ_GROUPS[kind]
+    return a
 
 # -----------------------------------------------------------------------------
 # Guardrail: Filter offensive/negative input and gently steer tone
 # -----------------------------------------------------------------------------
-@guardrail(
-    name="civility_guardrail",
-    description="Blocks or reframes negative/offensive language to keep interactions positive.",
-    type="input"
+_GENTLE_REPLY = (
+    "I’m here to help. Let’s keep things respectful so I can assist you quickly. "
+    "Could you please restate your request? For example: "
+    "‘Please check my order status ORD-1234’ or ‘What is your return policy?’"
 )
+
 def civility_guardrail_fn(user_input: str):
     if is_negative_or_offensive(user_input):
         # Return False + replacement text to stop raw input and reframe
-        gentle = (
-            "I’m here to help. Let’s keep things respectful so I can assist you quickly. "
-            "Could you please restate your request? For example: "
-            "‘Please check my order status ORD-1234’ or ‘What is your return policy?’"
-        )
-        return False, gentle
+        return False, _GENTLE_REPLY
     # Allow input to pass through
     return True, user_input
 
 civility_guardrail = Guardrail(
     name="civility_guardrail",
-    description="Keeps interactions positive and respectful.",
+    description="Blocks or reframes negative/offensive language to keep interactions positive.",
     fn=civility_guardrail_fn,
     type="input"
 )
 
+# -----------------------------------------------------------------------------
+# Precomputed order responses (ORDERS is static at runtime)
+# -----------------------------------------------------------------------------
+def _format_order(order_id: str, data: Dict[str, Any]) -> str:
+    parts = [f"Status: {data['status']}"]
+    if data["eta"] and data["eta"] != "N/A":
+        parts.append(f"ETA: {data['eta']}")
+    if data["carrier"]:
+        parts.append(f"Carrier: {data['carrier']}")
+    return f"Order {order_id} → " + ", ".join(parts)
+
+_ORDER_RESPONSES: Dict[str, str] = {oid: _format_order(oid, data) for oid, data in ORDERS.items()}
+
+def update_order(order_id: str, data: Dict[str, Any]) -> None:
+    # Keep the precomputed response (and any cached agent answer about it) in sync
+    ORDERS[order_id] = data
+    _ORDER_RESPONSES[order_id] = _format_order(order_id, data)
+    _AGENT_CACHE.invalidate(lambda key: key[0] == order_id)
+
+# -----------------------------------------------------------------------------
+# Request-scoped context (async-safe; each concurrent request sees its own)
+# -----------------------------------------------------------------------------
+@dataclass(slots=True, frozen=True)
+class RequestCtx:
+    last_user_message: str
+    customer_id: str
+    message_lc: str  # casefolded once per request
+
+_REQUEST_CTX: ContextVar[RequestCtx] = ContextVar("req_ctx", default=RequestCtx("", "", ""))
+
 # -----------------------------------------------------------------------------
 # Function Tool: get_order_status with is_enabled + error_function
 # -----------------------------------------------------------------------------
-def _order_tool_enabled(context: Dict[str, Any]) -> bool:
-    # Enable only when user's latest message has order intent
-    text = context.get("last_user_message", "")
-    enabled = is_order_intent(text)
+def _order_tool_enabled(_context: Any = None) -> bool:
+    # Enable only when user's latest message has order intent (read from the request scope)
+    ctx = _REQUEST_CTX.get()
+    text = ctx.last_user_message
+    enabled = is_order_intent(ctx.message_lc)
     logging.info(f"[Tool Toggle] get_order_status enabled? {enabled} (message='{text}')")
     return enabled
 
+_ORDER_NOT_FOUND = (
+    "Sorry, I couldn’t find details for order '{order_id}'. "
+    "Please double-check the ID (e.g., ORD-1001) or ask me to connect you to a human agent."
+)
+
 def _order_tool_error(err: Exception, args: Dict[str, Any]):
-    # Friendly error message returned to the user
+    # Friendly error message for genuinely exceptional failures (unknown IDs never raise)
     order_id = args.get("order_id", "UNKNOWN")
-    msg = (
-        f"Sorry, I couldn’t find details for order '{order_id}'. "
-        "Please double-check the ID (e.g., ORD-1001) or ask me to connect you to a human agent."
-    )
     logging.error(f"[Tool Error] get_order_status: {err} (order_id={order_id})")
-    return msg
+    return _ORDER_NOT_FOUND.format(order_id=order_id)
+
+def _lookup_order(order_id: str) -> str:
+    # Unknown IDs are an expected outcome (typos, probing), so answer without raising
+    return _ORDER_RESPONSES.get(order_id) or _ORDER_NOT_FOUND.format(order_id=order_id)
 
 @function_tool(
     name="get_order_status",
@@ -139,114 +240,247 @@ def _order_tool_error(err: Exception, args: Dict[str, Any]):
 )
 def get_order_status(order_id: str):
     logging.info(f"[Tool Invoke] get_order_status(order_id={order_id})")
-    if order_id not in ORDERS:
-        # Raising triggers error_function to return a friendly message
-        raise KeyError(f"Order not found: {order_id}")
-    data = ORDERS[order_id]
-    parts = [f"Status: {data['status']}"]
-    if data["eta"] and data["eta"] != "N/A":
-        parts.append(f"ETA: {data['eta']}")
-    if data["carrier"]:
-        parts.append(f"Carrier: {data['carrier']}")
-    return f"Order {order_id} → " + ", ".join(parts)
+    return _lookup_order(order_id)
 
 # -----------------------------------------------------------------------------
 # Agents
 # -----------------------------------------------------------------------------
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ModelSettings:
     tool_choice: str = "auto"   # "auto" or "required"
-    metadata: Dict[str, Any] = None
-
-# Human agent: receives handoffs
-human_agent = Agent(
-    client=client,
-    model="gpt-4.1-mini",
-    instructions=(
-        "You are a human support specialist. "
-        "Be empathetic, clarify the issue, and resolve or collect details for escalation tickets."
-    )
+    metadata: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}))
+    # Computed once in __post_init__; None when a metadata value is unhashable (e.g. a list)
+    _hash: int | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Snapshot caller dicts (or None) into a read-only view so instances can be shared
+        metadata = MappingProxyType(dict(self.metadata or {}))
+        object.__setattr__(self, "metadata", metadata)
+        try:
+            key_hash = hash((self.tool_choice, frozenset(metadata.items())))
+        except TypeError:
+            key_hash = None
+        object.__setattr__(self, "_hash", key_hash)
+
+    def __hash__(self):
+        if self._hash is None:
+            raise TypeError("ModelSettings with unhashable metadata values is not hashable")
+        return self._hash
+
+_DEFAULT_MODEL_SETTINGS = ModelSettings()
+
+BOT_MODEL = "gpt-4.1-mini"
+HUMAN_MODEL = "gpt-4.1-mini"
+
+BOT_INSTRUCTIONS = (
+    "You are a helpful Customer Support Bot. "
+    "1) Answer common FAQs succinctly. "
+    "2) For order inquiries, use the get_order_status tool if available. "
+    "3) If the query is complex or sentiment is negative, handoff to the HumanAgent. "
+    "Always be polite, concise, and solution-focused."
 )
 
+# Human agent: receives handoffs (built lazily, like the client)
+@functools.lru_cache(maxsize=1)
+def get_human_agent() -> Agent:
+    return Agent(
+        client=get_client(),
+        model=HUMAN_MODEL,
+        instructions=(
+            "You are a human support specialist. "
+            "Be empathetic, clarify the issue, and resolve or collect details for escalation tickets."
+        )
+    )
+
 # Bot agent: answers FAQs, looks up orders, and may escalate
-bot_agent = Agent(
-    client=client,
-    model="gpt-4.1-mini",
-    tools=[get_order_status],
-    guardrails=[civility_guardrail],
-    instructions=(
-        "You are a helpful Customer Support Bot. "
-        "1) Answer common FAQs succinctly. "
-        "2) For order inquiries, use the get_order_status tool if available. "
-        "3) If the query is complex or sentiment is negative, handoff to the HumanAgent. "
-        "Always be polite, concise, and solution-focused."
+@functools.lru_cache(maxsize=1)
+def get_bot_agent() -> Agent:
+    return Agent(
+        client=get_client(),
+        model=BOT_MODEL,
+        tools=[get_order_status],
+        guardrails=[civility_guardrail],
+        instructions=BOT_INSTRUCTIONS
     )
-)
+
+# -----------------------------------------------------------------------------
+# Response cache (L1: exact match on normalized message, LRU + TTL)
+# -----------------------------------------------------------------------------
+class LRUCache:
+    def __init__(self, max_size: int = 1000, ttl: float = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> None:
+        for key in [k for k in self._data if predicate(k)]:
+            del self._data[key]
+
+def _cache_key(message: str, tool_choice: str) -> str:
+    # Exact text, no folding: analyze() sees the message verbatim, so the key must too
+    return hashlib.md5(f"{tool_choice}|{message}".encode()).hexdigest()
+
+_L1 = LRUCache(max_size=1000, ttl=600.0)
+
+# -----------------------------------------------------------------------------
+# Response cache (agent answers: exact match on the prompt's inputs, LRU + TTL)
+# -----------------------------------------------------------------------------
+# The agent prompt is built only from the order ID and tool_choice, so those (plus the
+# customer, to keep answers per-customer) fully key it. update_order() invalidates.
+_AGENT_CACHE = LRUCache(max_size=1000, ttl=600.0)
 
 # -----------------------------------------------------------------------------
 # Routing / Orchestration
 # -----------------------------------------------------------------------------
-def handle_user_message(
+_REASON_NEGATIVE = sys.intern("Detected negative sentiment or offensive language. Human empathy required.")
+_REASON_TOOL_UNUSABLE = sys.intern("Order tool not available or order ID missing; requires human assistance.")
+_REASON_COMPLEX = sys.intern("Complex or ambiguous request.")
+
+# A word boundary run: non-space, whitespace, then (lookahead) another non-space. The
+# number of matches equals len(text.split()) - 1, without allocating the word list.
+_WORD_GAP_RE = re.compile(r"\S\s+(?=\S)")
+
+def _has_more_words_than(text: str, limit: int) -> bool:
+    gaps = 0
+    for _ in _WORD_GAP_RE.finditer(text):
+        gaps += 1
+        if gaps >= limit:
+            return True
+    return False
+
+def _order_prompt(order_id: str, tool_choice: str) -> str:
+    # Shared by the live agent call and the Batch API path so both ask the same thing
+    if tool_choice == "required":
+        return f"Fetch the status for {order_id}."
+    return f"User asks to track order {order_id}. Use the tool if available."
+
+def _handoff(reason: str, message: str, customer_id: str) -> Handoff:
+    return Handoff(
+        to=get_human_agent(),
+        reason=reason,
+        context={"last_user_message": message, "customer_id": customer_id}
+    )
+
+@functools.lru_cache(maxsize=4096)
+def _cached_metadata_for(customer_id: str, model_settings: ModelSettings) -> Mapping[str, Any]:
+    # Built once per (customer, settings) pair; read-only so the cached value can be shared
+    return MappingProxyType({**model_settings.metadata, "customer_id": customer_id})
+
+def _metadata_for(customer_id: str, model_settings: ModelSettings) -> Dict[str, Any]:
+    # Always a plain dict: the SDK may serialize or mutate it, so copy out of the memo
+    if model_settings._hash is None:
+        # Unhashable metadata (lists, dicts, ...) cannot key the memo; build it directly
+        return {**model_settings.metadata, "customer_id": customer_id}
+    return dict(_cached_metadata_for(customer_id, model_settings))
+
+async def _run_bot(prompt: str, model_settings: Dict[str, Any], cache_key: Hashable = None):
+    # Run the guardrail to completion first so a blocked turn never spends model tokens.
+    # Same predicate and outcome as the analyze() check in _handle: a negative handoff.
+    ctx = _REQUEST_CTX.get()
+    if is_negative_or_offensive(ctx.last_user_message):
+        logging.info("[Guardrail] Input blocked before reaching the model")
+        return _handoff(_REASON_NEGATIVE, ctx.last_user_message, ctx.customer_id)
+
+    if cache_key is not None:
+        cached = _AGENT_CACHE.get(cache_key)
+        if cached is not None:
+            logging.info("[Decision] Agent answer cache hit")
+            return cached
+
+    async with _LLM_SEMAPHORE:
+        result = await get_bot_agent().arun(
+            prompt,
+            model_settings={**model_settings, "guardrail_mode": "sequential"}
+        )
+    if cache_key is not None and not isinstance(result, Handoff):
+        _AGENT_CACHE.set(cache_key, result)
+    return result
+
+async def handle_user_message(
     message: str,
     customer_id: str,
-    model_settings: ModelSettings = ModelSettings(tool_choice="auto", metadata=None)
+    model_settings: ModelSettings = _DEFAULT_MODEL_SETTINGS
 ):
     """
     Main entry point that:
-      - Applies guardrails (handled by Agent automatically via guardrails list)
+      - Applies guardrails (checked to completion before any agent call)
       - Uses FAQs or tools as needed
       - Performs handoff when appropriate
       - Demonstrates model_settings (tool_choice + metadata)
+      - Serves repeated FAQ/default answers from the L1 cache
     """
+    token = _REQUEST_CTX.set(RequestCtx(message, customer_id, message.casefold()))
+    try:
+        return await _handle(message, customer_id, model_settings)
+    finally:
+        _REQUEST_CTX.reset(token)
+
+async def _handle(message: str, customer_id: str, model_settings: ModelSettings):
+    # 0) Exact-match cache; session metadata makes the answer non-shareable
+    cache_key = None
+    if not model_settings.metadata:
+        cache_key = _cache_key(message, model_settings.tool_choice)
+        cached = _L1.get(cache_key)
+        if cached is not None:
+            logging.info("[Decision] Cache hit")
+            return cached
 
     # 1) Quick sentiment/complexity check for handoff signals
-    negative = is_negative_or_offensive(message)
-    order_intent = is_order_intent(message)
-    order_id = extract_order_id(message)
+    a = analyze(message)
 
     # 2) Decide if we should immediately escalate (very negative input)
-    if negative:
+    if a.negative:
         logging.info("[Decision] Negative sentiment detected → Handoff to HumanAgent")
-        return Handoff(
-            to=human_agent,
-            reason="Detected negative sentiment or offensive language. Human empathy required.",
-            context={"last_user_message": message, "customer_id": customer_id}
-        )
+        return _handoff(_REASON_NEGATIVE, message, customer_id)
 
     # 3) Try FAQs first
-    faq_answer = match_faq(message)
-    if faq_answer and not order_intent:
+    if a.faq_answer and not a.order_intent:
         logging.info("[Decision] Answering FAQ")
-        return faq_answer
+        if cache_key:
+            _L1.set(cache_key, a.faq_answer)
+        return a.faq_answer
 
     # 4) Order tool path (respect tool_choice)
-    ctx = {"last_user_message": message, "customer_id": customer_id}
-    response_metadata = model_settings.metadata or {}
-    response_metadata["customer_id"] = customer_id
+    response_metadata = _metadata_for(customer_id, model_settings)
+    # Same rule as L1: calls carrying session metadata are not cached
+    agent_cache_key = (a.order_id, model_settings.tool_choice, customer_id) if cache_key else None
 
-    if order_intent:
+    if a.order_intent:
         if model_settings.tool_choice == "required":
-            # Force tool path if enabled; otherwise escalate
-            if _order_tool_enabled(ctx) and order_id:
-                return bot_agent.run(
-                    f"Fetch the status for {order_id}.",
-                    context=ctx,
-                    model_settings={"tool_choice": "required", "metadata": response_metadata}
+            # The tool is enabled for order-intent messages; force it if we have an ID, else escalate
+            if a.order_id:
+                return await _run_bot(
+                    _order_prompt(a.order_id, "required"),
+                    {"tool_choice": "required", "metadata": response_metadata},
+                    agent_cache_key
                 )
             else:
                 logging.info("[Decision] Tool required but not usable → Handoff")
-                return Handoff(
-                    to=human_agent,
-                    reason="Order tool not available or order ID missing; requires human assistance.",
-                    context={"last_user_message": message, "customer_id": customer_id}
-                )
+                return _handoff(_REASON_TOOL_UNUSABLE, message, customer_id)
         else:
             # tool_choice="auto" → Bot decides
-            if order_id:
-                return bot_agent.run(
-                    f"User asks to track order {order_id}. Use the tool if available.",
-                    context=ctx,
-                    model_settings={"tool_choice": "auto", "metadata": response_metadata}
+            if a.order_id:
+                return await _run_bot(
+                    _order_prompt(a.order_id, "auto"),
+                    {"tool_choice": "auto", "metadata": response_metadata},
+                    agent_cache_key
                 )
             else:
                 # Ask the bot to collect the ID or escalate
@@ -255,34 +489,134 @@ def handle_user_message(
 
     # 5) If not FAQ and not order: simple capability or escalate for complexity
     # Heuristic: if message is long and ambiguous → escalate.
-    if len(message.split()) > 40 or "complicated" in message.lower() or "legal" in message.lower():
+    # Over 40 words needs more than 80 chars, so short messages skip the gap count entirely.
+    if a.complex_hint or (len(message) > 80 and _has_more_words_than(message, 40)):
         logging.info("[Decision] Complex query → Handoff to HumanAgent")
-        return Handoff(
-            to=human_agent,
-            reason="Complex or ambiguous request.",
-            context={"last_user_message": message, "customer_id": customer_id}
-        )
+        return _handoff(_REASON_COMPLEX, message, customer_id)
 
     # Default helpful response
     logging.info("[Decision] Default helpful response")
-    return (
+    answer = (
         "I can help with order tracking (share your order ID like ORD-1001) "
         "or answer policies like shipping time, warranty, and returns."
     )
+    if cache_key:
+        _L1.set(cache_key, answer)
+    return answer
+
+async def handle_user_messages(
+    rows: list[tuple[str, str]],
+    model_settings: ModelSettings = _DEFAULT_MODEL_SETTINGS
+) -> list:
+    """
+    Handles (message, customer_id) rows concurrently; agent calls overlap up to
+    MAX_CONCURRENCY. Results are returned in the same order as `rows`.
+    """
+    return await asyncio.gather(
+        *(handle_user_message(message, customer_id, model_settings) for message, customer_id in rows)
+    )
+
+# -----------------------------------------------------------------------------
+# Bulk / offline processing via the OpenAI Batch API
+# -----------------------------------------------------------------------------
+_BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def _needs_llm(a: Analysis) -> bool:
+    # Mirrors handle_user_message: only non-negative order messages with an ID reach the agent
+    return not a.negative and a.order_intent and a.order_id is not None
+
+async def handle_user_messages_batch(
+    rows: list[tuple[str, str]],
+    model_settings: ModelSettings = _DEFAULT_MODEL_SETTINGS,
+    poll_interval: float = 30.0
+) -> list:
+    """
+    Bulk entry point for (message, customer_id) rows, e.g. eval suites or email backlogs:
+      - Negative rows are handed off straight from the analyze() scan
+      - FAQ, handoff and ask-for-ID rows are answered locally via handle_user_message
+      - Remaining order lookups go out as one Batch API job (50% cheaper, async),
+        using the same prompt as the live path for model_settings.tool_choice
+      - Rows the job does not answer fall back to concurrent live calls
+    Results are returned in the same order as `rows`. Rows answered by the batch job are
+    the completion text (str); every other row is exactly what handle_user_message
+    returns for it (str, agent result, or Handoff).
+    """
+    results: list = [None] * len(rows)
+    lines = []
+    for i, (message, customer_id) in enumerate(rows):
+        a = analyze(message)
+        if a.negative:
+            results[i] = _handoff(_REASON_NEGATIVE, message, customer_id)
+            continue
+        if not _needs_llm(a):
+            results[i] = await handle_user_message(message, customer_id, model_settings)
+            continue
+        # The batch endpoint cannot call our tool, so the (local) lookup is inlined
+        prompt = _order_prompt(a.order_id, model_settings.tool_choice)
+        lookup = _lookup_order(a.order_id)
+        lines.append(json.dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": BOT_MODEL,
+                "messages": [
+                    {"role": "system", "content": BOT_INSTRUCTIONS},
+                    {"role": "user", "content": f"{prompt}\n\nget_order_status result: {lookup}"},
+                ],
+            },
+        }))
+
+    if not lines:
+        return results
+
+    logging.info(f"[Batch] Submitting {len(lines)} of {len(rows)} messages to the Batch API")
+    client = get_client()
+    batch_file = await client.files.create(
+        file=("support_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    while batch.status not in _BATCH_TERMINAL_STATUSES:
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+    logging.info(f"[Batch] Batch {batch.id} finished with status '{batch.status}'")
+
+    if batch.output_file_id:
+        output = await client.files.content(batch.output_file_id)
+        for line in output.text.splitlines():
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                logging.error(f"[Batch] Row {record['custom_id']} failed: {record.get('error')}")
+                continue
+            results[int(record["custom_id"])] = response["body"]["choices"][0]["message"]["content"]
+
+    # Anything the batch did not answer (failed rows, expired job) falls back to live calls
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        live = await handle_user_messages([rows[i] for i in pending], model_settings)
+        for i, result in zip(pending, live):
+            results[i] = result
+    return results
 
 # -----------------------------------------------------------------------------
 # Demo / Examples
 # -----------------------------------------------------------------------------
-if __name__ == "__main__":
+async def _demo():
     print("\n--- Demo 1: Friendly FAQ ---")
-    out1 = handle_user_message(
+    out1 = await handle_user_message(
         "Hi! What’s your return policy?",
         customer_id="CUST-789"
     )
     print(out1 if not isinstance(out1, Handoff) else f"[HANDOFF] {out1.reason}")
 
     print("\n--- Demo 2: Order tracking with ID (tool auto) ---")
-    out2 = handle_user_message(
+    out2 = await handle_user_message(
         "Can you track my order ORD-1001?",
         customer_id="CUST-789",
         model_settings=ModelSettings(tool_choice="auto", metadata={"channel": "web"})
@@ -293,7 +627,7 @@ if __name__ == "__main__":
         print(out2)
 
     print("\n--- Demo 3: Order tool REQUIRED, valid ID ---")
-    out3 = handle_user_message(
+    out3 = await handle_user_message(
         "Status for ORD-1002 please.",
         customer_id="CUST-001",
         model_settings=ModelSettings(tool_choice="required", metadata={"channel": "mobile-app"})
@@ -301,15 +635,15 @@ if __name__ == "__main__":
     print(out3 if not isinstance(out3, Handoff) else f"[HANDOFF] {out3.reason}")
 
     print("\n--- Demo 4: Missing ID (tool auto) ---")
-    out4 = handle_user_message(
+    out4 = await handle_user_message(
         "I want the status of my order",
         customer_id="CUST-002",
         model_settings=ModelSettings(tool_choice="auto", metadata={"channel": "web"})
     )
     print(out4 if not isinstance(out4, Handoff) else f"[HANDOFF] {out4.reason}")
 
-    print("\n--- Demo 5: Unknown order (error_function path) ---")
-    out5 = handle_user_message(
+    print("\n--- Demo 5: Unknown order (not-found reply, no exception) ---")
+    out5 = await handle_user_message(
         "Track ORD-9999 for me",
         customer_id="CUST-002",
         model_settings=ModelSettings(tool_choice="auto", metadata={"channel": "web"})
@@ -317,7 +651,7 @@ if __name__ == "__main__":
     print(out5 if not isinstance(out5, Handoff) else f"[HANDOFF] {out5.reason}")
 
     print("\n--- Demo 6: Offensive/negative message triggers guardrail & escalation ---")
-    out6 = handle_user_message(
+    out6 = await handle_user_message(
         "This is the worst service ever, I’m furious! Track my damn order ORD-1003.",
         customer_id="CUST-123",
         model_settings=ModelSettings(tool_choice="auto", metadata={"channel": "web"})
@@ -329,9 +663,12 @@ if __name__ == "__main__":
 
     print("\n--- Demo 7: Complex/ambiguous → Handoff ---")
     long_msg = "Hello, I need help with a multi-country warranty claim involving two shipments, a customs dispute, and a missed delivery window, plus legal follow-up."
-    out7 = handle_user_message(
+    out7 = await handle_user_message(
         long_msg,
         customer_id="CUST-555",
         model_settings=ModelSettings(tool_choice="auto", metadata={"channel": "email"})
     )
     print(out7 if not isinstance(out7, Handoff) else f"[HANDOFF] {out7.reason}")
+
+if __name__ == "__main__":
+    asyncio.run(_demo())